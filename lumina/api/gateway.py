@@ -5,19 +5,29 @@ This module implements the API gateway that exposes Lumina AI capabilities
 to clients through HTTP and WebSocket interfaces.
 """
 
-from typing import Dict, Any, Optional
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException, status
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import Dict, Any, Optional, Set
+from fastapi import FastAPI, Request, Response, WebSocket, WebSocketDisconnect, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from pydantic import BaseModel
-import json
+import msgspec
+import orjson
+import zstandard
+import hashlib
+import hmac
+import importlib
 import logging
 import asyncio
-from datetime import datetime
+import os
+import sys
+
+from lumina.common import utils
 
 logger = logging.getLogger(__name__)
 
 # Models for request and response
-class MessageRequest(BaseModel):
+class MessageRequest(msgspec.Struct):
     """Model for incoming message requests."""
     message: str
     user_id: str
@@ -33,9 +43,67 @@ class MessageResponse(BaseModel):
     tokens: Optional[Dict[str, int]] = None
     error: Optional[str] = None
 
+# Request bodies are decoded and validated by msgspec in a single pass
+_message_request_decoder = msgspec.json.Decoder(MessageRequest)
+_json_encoder = msgspec.json.Encoder()
+_MESSAGE_REQUEST_SCHEMA = msgspec.json.schema(MessageRequest)["$defs"]["MessageRequest"]
+
 # OAuth2 scheme for token authentication
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+@lru_cache(maxsize=10_000)
+def _validate_signed_token(token: bytes, user_id: str, secret: bytes) -> bool:
+    """
+    Check a token against the HMAC-SHA256 signature of a user ID.
+    
+    Results are cached per (token, user_id, secret) so repeat requests from a
+    client skip the signature computation.
+    
+    Args:
+        token: Authentication token bytes, the hex digest of the signature
+        user_id: User identifier
+        secret: Secret key used to sign tokens
+        
+    Returns:
+        True if the token matches the signature, False otherwise
+    """
+    expected = hmac.new(secret, user_id.encode("utf-8"), hashlib.sha256).hexdigest().encode("ascii")
+    return hmac.compare_digest(token, expected)
+
+# WebSocket subprotocols for MessagePack-encoded binary frames; with "msgpack+zstd"
+# every frame starts with a one-byte header saying whether the payload is compressed
+MSGPACK_SUBPROTOCOL = "msgpack"
+MSGPACK_ZSTD_SUBPROTOCOL = "msgpack+zstd"
+_msgpack_encoder = msgspec.msgpack.Encoder()
+_msgpack_decoder = msgspec.msgpack.Decoder()
+
+# Frames at least this large are compressed on the "msgpack+zstd" subprotocol
+WS_COMPRESSION_THRESHOLD = 1024
+# Largest decompressed frame accepted from a client
+WS_MAX_DECOMPRESSED_SIZE = 16 * 1024 * 1024
+_FRAME_RAW = b"\x00"
+_FRAME_ZSTD = b"\x01"
+_zstd_compressor = zstandard.ZstdCompressor(level=3)
+_zstd_decompressor = zstandard.ZstdDecompressor()
+
+# Default cap on concurrent WebSocket connections per gateway
+MAX_CONNECTIONS = 10_000
+
+# uvloop is not available on Windows, where the default asyncio loop is used
+EVENT_LOOP = "asyncio" if sys.platform == "win32" else "uvloop"
+
+# Worker processes for multi-process serving: 2n + 1 for n CPU cores
+DEFAULT_WORKERS = (os.cpu_count() or 1) * 2 + 1
+
+# Environment variable that turns on request batching in services built by app_factory
+BATCHING_ENV_VAR = "ORCHESTRATION_BATCHING"
+
+# Environment variable naming the configuration file read by build_gateway
+CONFIG_PATH_ENV_VAR = "LUMINA_CONFIG"
+
+# Import path of the application factory used by multi-worker runs
+APP_FACTORY = "lumina.api.gateway:app_factory"
+
 class APIGateway:
     """
     API Gateway for Lumina AI.
@@ -44,37 +112,80 @@ class APIGateway:
     to clients through HTTP and WebSocket interfaces.
     """
     
-    def __init__(self, orchestration_service):
+    def __init__(self, orchestration_service, max_connections: int = MAX_CONNECTIONS,
+                 token_secret: Optional[str] = None):
         """
         Initialize the API gateway.
         
+        The orchestration service must provide an ``aprocess_message`` coroutine
+        and a ``conversation_id``; an ``aclose`` coroutine, if present, is
+        awaited on shutdown.
+        
         Args:
             orchestration_service: The central orchestration service
+            max_connections: Maximum number of concurrent WebSocket connections
+            token_secret: Optional secret for HMAC-signed tokens; when omitted,
+                only a basic token format check is performed
         """
         self.orchestration_service = orchestration_service
-        self.app = FastAPI(title="Lumina AI API", version="0.1.0")
-        self.active_connections = {}
+        self._token_secret = token_secret.encode("utf-8") if token_secret else None
+        self.app = FastAPI(title="Lumina AI API", version="0.1.0", lifespan=self._lifespan)
+        self.active_connections: Dict[str, WebSocket] = {}
+        # Open sockets counted against max_connections, independent of the client IDs they use
+        self._open_sockets: Set[WebSocket] = set()
+        self.max_connections = max_connections
         self._setup_routes()
         logger.info("API Gateway initialized")
     
+    @asynccontextmanager
+    async def _lifespan(self, app: FastAPI):
+        """
+        Manage resources tied to the application lifetime.
+        
+        Args:
+            app: The FastAPI application
+        """
+        yield
+        # Release pooled provider connections on shutdown, for services that hold any
+        aclose = getattr(self.orchestration_service, "aclose", None)
+        if aclose is not None:
+            await aclose()
+    
     def _setup_routes(self):
         """Set up API routes."""
         
-        @self.app.post("/api/messages", response_model=MessageResponse)
+        @self.app.post(
+            "/api/messages",
+            response_model=MessageResponse,
+            openapi_extra={
+                "requestBody": {
+                    "required": True,
+                    "content": {"application/json": {"schema": _MESSAGE_REQUEST_SCHEMA}}
+                }
+            }
+        )
         async def process_message(
-            request: MessageRequest,
+            http_request: Request,
             token: str = Depends(oauth2_scheme)
         ):
             """
             Process a message through the Lumina AI system.
             
             Args:
-                request: The message request
+                http_request: The HTTP request carrying a MessageRequest body
                 token: Authentication token
                 
             Returns:
                 The message response
             """
+            try:
+                request = _message_request_decoder.decode(await http_request.body())
+            except msgspec.DecodeError as e:
+                raise HTTPException(
+                    status_code=422,
+                    detail=str(e)
+                )
+            
             # Validate token (simplified for now)
             if not self._validate_token(token, request.user_id):
                 raise HTTPException(
@@ -85,38 +196,33 @@ class APIGateway:
             
             # Process message through orchestration service
             try:
-                response = self.orchestration_service.process_message(
+                response = await self.orchestration_service.aprocess_message(
                     request.message,
                     request.user_id,
                     request.context
                 )
                 
-                # Handle error responses
+                # Handle error responses, keeping any timestamp the orchestration layer set
                 if "error" in response:
-                    return MessageResponse(
-                        content="",
-                        conversation_id=self.orchestration_service.conversation_id,
-                        timestamp=datetime.now().isoformat(),
-                        error=response["error"]
-                    )
+                    return self._error_response(response["error"], response.get("timestamp"))
                 
-                # Return successful response
-                return MessageResponse(
-                    content=response["content"],
-                    provider=response.get("provider"),
-                    model=response.get("model"),
-                    conversation_id=response["conversation_id"],
-                    timestamp=response["timestamp"],
-                    tokens=response.get("tokens")
+                # Return successful response, encoded directly in the MessageResponse shape;
+                # the model itself is only used for the OpenAPI schema on this path
+                return Response(
+                    content=_json_encoder.encode({
+                        "content": response["content"],
+                        "provider": response.get("provider"),
+                        "model": response.get("model"),
+                        "conversation_id": response["conversation_id"],
+                        "timestamp": response["timestamp"],
+                        "tokens": response.get("tokens"),
+                        "error": None
+                    }),
+                    media_type="application/json"
                 )
             except Exception as e:
                 logger.error(f"Error processing message: {str(e)}")
-                return MessageResponse(
-                    content="",
-                    conversation_id=self.orchestration_service.conversation_id,
-                    timestamp=datetime.now().isoformat(),
-                    error=f"Internal server error: {str(e)}"
-                )
+                return self._error_response(f"Internal server error: {str(e)}")
         
         @self.app.websocket("/ws/{client_id}")
         async def websocket_endpoint(websocket: WebSocket, client_id: str):
@@ -129,6 +235,24 @@ class APIGateway:
             """
             await self._handle_websocket_connection(websocket, client_id)
     
+    def _error_response(self, error: str, timestamp: Optional[str] = None) -> MessageResponse:
+        """
+        Build an error response for the current conversation.
+        
+        Args:
+            error: Error message
+            timestamp: Timestamp to report, generated only when not provided
+            
+        Returns:
+            The error message response
+        """
+        return MessageResponse(
+            content="",
+            conversation_id=self.orchestration_service.conversation_id,
+            timestamp=timestamp or utils.timestamp(),
+            error=error
+        )
+    
     async def _handle_websocket_connection(self, websocket: WebSocket, client_id: str):
         """
         Handle a WebSocket connection.
@@ -137,50 +261,113 @@ class APIGateway:
             websocket: The WebSocket connection
             client_id: Client identifier
         """
-        await websocket.accept()
+        # Clients opt into MessagePack framing, optionally compressed, by requesting a subprotocol
+        requested = websocket.scope.get("subprotocols", ())
+        if MSGPACK_ZSTD_SUBPROTOCOL in requested:
+            subprotocol = MSGPACK_ZSTD_SUBPROTOCOL
+        elif MSGPACK_SUBPROTOCOL in requested:
+            subprotocol = MSGPACK_SUBPROTOCOL
+        else:
+            subprotocol = None
+        await websocket.accept(subprotocol=subprotocol)
+        
+        # Reject new connections once the gateway is at capacity (1013: try again later)
+        if len(self._open_sockets) >= self.max_connections:
+            logger.warning(f"Rejecting WebSocket connection for client {client_id}: connection limit reached")
+            await websocket.close(code=1013)
+            return
+        
+        # Each client ID may hold one connection at a time (1008: policy violation)
+        if client_id in self.active_connections:
+            logger.warning(f"Rejecting WebSocket connection for client {client_id}: client ID already connected")
+            await websocket.close(code=1008)
+            return
+        
+        self._open_sockets.add(websocket)
         self.active_connections[client_id] = websocket
         logger.info(f"WebSocket connection established for client: {client_id}")
         
         try:
             while True:
                 # Receive message from client
-                data = await websocket.receive_text()
-                message_data = json.loads(data)
+                message_data = await self._receive_message(websocket, subprotocol)
                 
                 # Validate message format
                 if "message" not in message_data or "user_id" not in message_data:
-                    await websocket.send_json({
+                    await self._send_message(websocket, {
                         "error": "Invalid message format. Must include 'message' and 'user_id'."
-                    })
+                    }, subprotocol)
                     continue
                 
                 # Process message through orchestration service
-                response = self.orchestration_service.process_message(
+                response = await self.orchestration_service.aprocess_message(
                     message_data["message"],
                     message_data["user_id"],
                     message_data.get("context")
                 )
                 
                 # Send response back to client
-                await websocket.send_json(response)
+                await self._send_message(websocket, response, subprotocol)
         except WebSocketDisconnect:
-            # Remove connection when client disconnects
-            if client_id in self.active_connections:
-                del self.active_connections[client_id]
             logger.info(f"WebSocket connection closed for client: {client_id}")
         except Exception as e:
             logger.error(f"WebSocket error for client {client_id}: {str(e)}")
             # Attempt to send error message
             try:
-                await websocket.send_json({
+                await self._send_message(websocket, {
                     "error": f"Server error: {str(e)}"
-                })
+                }, subprotocol)
             except:
                 pass
+        finally:
+            self._open_sockets.discard(websocket)
+            del self.active_connections[client_id]
+    
+    async def _receive_message(self, websocket: WebSocket, subprotocol: Optional[str]) -> Dict[str, Any]:
+        """
+        Receive and decode a message from a WebSocket connection.
+        
+        Args:
+            websocket: The WebSocket connection
+            subprotocol: The negotiated subprotocol, or None for JSON text frames
             
-            # Remove connection on error
-            if client_id in self.active_connections:
-                del self.active_connections[client_id]
+        Returns:
+            The decoded message
+        """
+        if subprotocol == MSGPACK_ZSTD_SUBPROTOCOL:
+            data = await websocket.receive_bytes()
+            header, payload = data[:1], data[1:]
+            if header == _FRAME_ZSTD:
+                size = zstandard.frame_content_size(payload)
+                if size < 0 or size > WS_MAX_DECOMPRESSED_SIZE:
+                    raise ValueError("Compressed frame size is unknown or too large")
+                payload = _zstd_decompressor.decompress(payload)
+            elif header != _FRAME_RAW:
+                raise ValueError("Invalid frame header")
+            return _msgpack_decoder.decode(payload)
+        if subprotocol == MSGPACK_SUBPROTOCOL:
+            return _msgpack_decoder.decode(await websocket.receive_bytes())
+        return orjson.loads(await websocket.receive_text())
+    
+    async def _send_message(self, websocket: WebSocket, payload: Dict[str, Any], subprotocol: Optional[str]) -> None:
+        """
+        Encode and send a message over a WebSocket connection.
+        
+        Args:
+            websocket: The WebSocket connection
+            payload: The message to send
+            subprotocol: The negotiated subprotocol, or None for JSON text frames
+        """
+        if subprotocol == MSGPACK_ZSTD_SUBPROTOCOL:
+            data = _msgpack_encoder.encode(payload)
+            if len(data) >= WS_COMPRESSION_THRESHOLD:
+                await websocket.send_bytes(_FRAME_ZSTD + _zstd_compressor.compress(data))
+            else:
+                await websocket.send_bytes(_FRAME_RAW + data)
+        elif subprotocol == MSGPACK_SUBPROTOCOL:
+            await websocket.send_bytes(_msgpack_encoder.encode(payload))
+        else:
+            await websocket.send_text(orjson.dumps(payload).decode())
     
     def _validate_token(self, token: str, user_id: str) -> bool:
         """
@@ -193,18 +380,129 @@ class APIGateway:
         Returns:
             True if token is valid, False otherwise
         """
-        # Simplified token validation for now
-        # In a production system, this would validate against a proper auth system
-        return token is not None and len(token) > 10
+        if token is None:
+            return False
+        
+        if self._token_secret is None:
+            # Simplified token validation when no signing secret is configured
+            return len(token) > 10
+        
+        return _validate_signed_token(token.encode("utf-8"), user_id, self._token_secret)
     
-    def run(self, host: str = "0.0.0.0", port: int = 8000):
+    def run(self, host: str = "0.0.0.0", port: int = 8000, workers: int = 1, factory: Optional[str] = None):
         """
         Run the API gateway.
         
+        With more than one worker, each worker process builds its own gateway by
+        calling ``factory``, so this instance's orchestration service, providers
+        and settings are not used; a factory is required in that case.
+        
         Args:
             host: Host to bind to
             port: Port to bind to
+            workers: Number of worker processes
+            factory: Import path ("module:function") of a function returning the
+                application for each worker, such as APP_FACTORY
+        
+        Raises:
+            ValueError: If more than one worker is requested without a factory
         """
         import uvicorn
-        logger.info(f"Starting API Gateway on {host}:{port}")
-        uvicorn.run(self.app, host=host, port=port)
+        if workers > 1 and factory is None:
+            raise ValueError("Running more than one worker requires a factory import path")
+        
+        logger.info(f"Starting API Gateway on {host}:{port} with {workers} worker(s)")
+        if workers > 1:
+            uvicorn.run(
+                factory,
+                factory=True,
+                host=host,
+                port=port,
+                workers=workers,
+                loop=EVENT_LOOP,
+                http="httptools",
+                ws="websockets",
+                ws_per_message_deflate=True
+            )
+        else:
+            uvicorn.run(
+                self.app,
+                host=host,
+                port=port,
+                loop=EVENT_LOOP,
+                http="httptools",
+                ws="websockets",
+                ws_per_message_deflate=True
+            )
+
+def _batching_enabled() -> bool:
+    """Whether request batching is turned on through the environment."""
+    return os.environ.get(BATCHING_ENV_VAR, "").lower() in ("1", "true", "yes")
+
+def _create_provider(options: Dict[str, Any]) -> Any:
+    """
+    Create a provider from its configuration.
+    
+    Args:
+        options: Provider configuration; "class" is the import path
+            ("module:ClassName") and the other entries are constructor arguments
+    
+    Returns:
+        The provider instance
+    """
+    module_name, _, class_name = options["class"].partition(":")
+    provider_class = getattr(importlib.import_module(module_name), class_name)
+    kwargs = {key: value for key, value in options.items() if key != "class"}
+    return provider_class(**kwargs)
+
+def build_gateway(config: Optional[Any] = None, batching: Optional[bool] = None) -> APIGateway:
+    """
+    Build an API gateway configured from the environment and configuration.
+    
+    Every entry under ``providers`` with a "class" import path is registered
+    as a provider. Tokens are checked against HMAC signatures when
+    ``security.jwt_secret`` (the JWT_SECRET environment variable) is set.
+    
+    Args:
+        config: Configuration manager; when omitted, one is created from the file
+            named by the LUMINA_CONFIG environment variable and the environment
+        batching: Whether the orchestration service batches concurrent requests;
+            read from the ORCHESTRATION_BATCHING environment variable when omitted
+    
+    Returns:
+        A new API gateway
+    """
+    from lumina.common.config import ConfigManager
+    from lumina.orchestration.service import OrchestrationService
+    if config is None:
+        config = ConfigManager(os.environ.get(CONFIG_PATH_ENV_VAR))
+    if batching is None:
+        batching = _batching_enabled()
+    
+    service = OrchestrationService(batching=batching)
+    for provider_id, options in (config.get("providers") or {}).items():
+        if not isinstance(options, dict) or "class" not in options:
+            logger.warning(f"Skipping provider {provider_id}: no class configured")
+            continue
+        service.register_provider(provider_id, _create_provider(options))
+    if not service.providers:
+        logger.warning("No providers configured")
+    
+    return APIGateway(service, token_secret=config.get("security.jwt_secret"))
+
+def app_factory(batching: Optional[bool] = None) -> FastAPI:
+    """
+    Build the API gateway application for a uvicorn worker process.
+    
+    Args:
+        batching: Whether the orchestration service batches concurrent requests;
+            read from the ORCHESTRATION_BATCHING environment variable when omitted
+    
+    Returns:
+        The FastAPI application of a new gateway
+    """
+    return build_gateway(batching=batching).app
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    build_gateway().run(workers=DEFAULT_WORKERS, factory=APP_FACTORY)
@@ -6,17 +6,34 @@ including loading configuration from environment variables and configuration fil
 """
 
 import os
-import json
-from typing import Dict, Any, Optional
+from functools import lru_cache
+from typing import Dict, Any, Optional, Tuple
 import logging
-from dotenv import load_dotenv
 
-from lumina.common.utils import load_config, merge_dicts
+from lumina.common.utils import load_config, save_config, merge_dicts
 
 logger = logging.getLogger(__name__)
 
-# Load environment variables from .env file if it exists
-load_dotenv()
+# Environment variables mapped to the configuration keys they set
+_ENV_CONFIG_KEYS = (
+    # Provider API keys
+    ("OPENAI_API_KEY", "providers.openai.api_key"),
+    ("CLAUDE_API_KEY", "providers.claude.api_key"),
+    ("GEMINI_API_KEY", "providers.gemini.api_key"),
+    ("DEEPSEEK_API_KEY", "providers.deepseek.api_key"),
+    ("GROK_API_KEY", "providers.grok.api_key"),
+    # API configuration
+    ("API_HOST", "api.host"),
+    # Security configuration
+    ("JWT_SECRET", "security.jwt_secret"),
+    # Log level
+    ("LOG_LEVEL", "logging.level"),
+)
+
+@lru_cache(maxsize=256)
+def _split_key_path(key_path: str) -> Tuple[str, ...]:
+    """Split a dotted key path into its components."""
+    return tuple(key_path.split('.'))
 
 class ConfigManager:
     """
@@ -26,6 +43,9 @@ class ConfigManager:
     including environment variables and configuration files.
     """
     
+    # Whether variables from a .env file have been loaded into the environment
+    _dotenv_loaded = False
+    
     def __init__(self, config_path: Optional[str] = None):
         """
         Initialize the configuration manager.
@@ -36,6 +56,12 @@ class ConfigManager:
         self.config = {}
         self.config_path = config_path
         
+        # Load environment variables from .env file if it exists, once per process
+        if not ConfigManager._dotenv_loaded:
+            from dotenv import load_dotenv
+            load_dotenv()
+            ConfigManager._dotenv_loaded = True
+        
         # Load configuration from file if provided
         if config_path:
             self._load_from_file(config_path)
@@ -59,38 +85,20 @@ class ConfigManager:
     def _load_from_env(self) -> None:
         """Load configuration from environment variables."""
         env_config = {}
+        env = os.environ
         
-        # Provider API keys
-        providers = {
-            "OPENAI_API_KEY": "providers.openai.api_key",
-            "CLAUDE_API_KEY": "providers.claude.api_key",
-            "GEMINI_API_KEY": "providers.gemini.api_key",
-            "DEEPSEEK_API_KEY": "providers.deepseek.api_key",
-            "GROK_API_KEY": "providers.grok.api_key"
-        }
-        
-        for env_var, config_key in providers.items():
-            if os.environ.get(env_var):
-                self._set_nested_key(env_config, config_key, os.environ.get(env_var))
+        for env_var, config_key in _ENV_CONFIG_KEYS:
+            value = env.get(env_var)
+            if value:
+                self._set_nested_key(env_config, config_key, value)
         
-        # API configuration
-        if os.environ.get("API_HOST"):
-            self._set_nested_key(env_config, "api.host", os.environ.get("API_HOST"))
-        
-        if os.environ.get("API_PORT"):
+        # API port
+        port_value = env.get("API_PORT")
+        if port_value:
             try:
-                port = int(os.environ.get("API_PORT", "8000"))
-                self._set_nested_key(env_config, "api.port", port)
+                self._set_nested_key(env_config, "api.port", int(port_value))
             except ValueError:
-                logger.warning(f"Invalid API_PORT value: {os.environ.get('API_PORT')}")
-        
-        # Security configuration
-        if os.environ.get("JWT_SECRET"):
-            self._set_nested_key(env_config, "security.jwt_secret", os.environ.get("JWT_SECRET"))
-        
-        # Log level
-        if os.environ.get("LOG_LEVEL"):
-            self._set_nested_key(env_config, "logging.level", os.environ.get("LOG_LEVEL"))
+                logger.warning(f"Invalid API_PORT value: {port_value}")
         
         # Merge environment configuration
         self.config = merge_dicts(self.config, env_config)
@@ -105,7 +113,7 @@ class ConfigManager:
             key_path: The path to the key, using dot notation (e.g., "providers.openai.api_key")
             value: The value to set
         """
-        keys = key_path.split('.')
+        keys = _split_key_path(key_path)
         current = config_dict
         
         for i, key in enumerate(keys):
@@ -127,10 +135,9 @@ class ConfigManager:
         Returns:
             The configuration value, or the default if not found
         """
-        keys = key_path.split('.')
         current = self.config
         
-        for key in keys:
+        for key in _split_key_path(key_path):
             if isinstance(current, dict) and key in current:
                 current = current[key]
             else:
@@ -163,15 +170,11 @@ class ConfigManager:
             logger.warning("No configuration path specified")
             return False
         
-        try:
-            os.makedirs(os.path.dirname(path), exist_ok=True)
-            with open(path, 'w') as f:
-                json.dump(self.config, f, indent=2)
-            logger.info(f"Configuration saved to {path}")
-            return True
-        except Exception as e:
-            logger.error(f"Error saving configuration: {str(e)}")
+        if not save_config(self.config, path):
             return False
+        
+        logger.info(f"Configuration saved to {path}")
+        return True
     
     def get_all(self) -> Dict[str, Any]:
         """
@@ -5,8 +5,12 @@ This module defines the abstract base classes and interfaces that
 must be implemented by various components of the Lumina AI system.
 """
 
+import asyncio
 from abc import ABC, abstractmethod
-from typing import Dict, Any, Optional, List
+from typing import TYPE_CHECKING, Dict, Any, Optional, List, Tuple
+
+if TYPE_CHECKING:
+    import httpx
 
 
 class BaseProvider(ABC):
@@ -17,6 +21,20 @@ class BaseProvider(ABC):
     implement its abstract methods.
     """
     
+    # HTTP client shared by the orchestration service, set on registration. It is bound
+    # to the serving event loop, so use it from aprocess_message, not from the blocking
+    # methods that run in worker threads
+    http_client: Optional["httpx.AsyncClient"] = None
+    
+    def set_http_client(self, client: "httpx.AsyncClient") -> None:
+        """
+        Set the HTTP client used for outbound provider requests.
+        
+        Args:
+            client: Pooled HTTP client shared across providers
+        """
+        self.http_client = client
+    
     @abstractmethod
     def process_message(self, message: str, context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
@@ -31,6 +49,67 @@ class BaseProvider(ABC):
         """
         pass
     
+    async def aprocess_message(self, message: str, context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Process a user message asynchronously and return a response.
+        
+        The default implementation runs the blocking ``process_message`` in a
+        worker thread. Providers making HTTP calls should override it and send
+        them through ``http_client``.
+        
+        Args:
+            message: The user message to process
+            context: Optional context information
+            
+        Returns:
+            A dictionary containing the response and metadata
+        """
+        return await asyncio.to_thread(self.process_message, message, context)
+    
+    def process_batch(self, requests: List[Tuple[str, Optional[Dict[str, Any]]]]) -> List[Any]:
+        """
+        Process a batch of user messages in one call.
+        
+        The default implementation processes each message in turn. Providers
+        supporting batch inference should override it.
+        
+        Args:
+            requests: (message, context) pairs to process
+            
+        Returns:
+            One response dictionary per request, in the same order; a request
+            that failed on its own is represented by its exception
+        """
+        responses = []
+        for message, context in requests:
+            try:
+                responses.append(self.process_message(message, context))
+            except Exception as e:
+                responses.append(e)
+        return responses
+    
+    async def aprocess_batch(self, requests: List[Tuple[str, Optional[Dict[str, Any]]]]) -> List[Any]:
+        """
+        Process a batch of user messages asynchronously in one call.
+        
+        The default implementation runs an overridden ``process_batch`` in a
+        worker thread, and otherwise processes the messages concurrently
+        through ``aprocess_message``.
+        
+        Args:
+            requests: (message, context) pairs to process
+            
+        Returns:
+            One response dictionary per request, in the same order; a request
+            that failed on its own is represented by its exception
+        """
+        if type(self).process_batch is not BaseProvider.process_batch:
+            return await asyncio.to_thread(self.process_batch, requests)
+        return list(await asyncio.gather(
+            *(self.aprocess_message(message, context) for message, context in requests),
+            return_exceptions=True
+        ))
+    
     @abstractmethod
     def get_capabilities(self) -> Dict[str, Any]:
         """
@@ -4,15 +4,25 @@ Utility functions for Lumina AI.
 This module provides common utility functions used across the Lumina AI system.
 """
 
-import json
 import logging
 import os
-from typing import Dict, Any, Optional, List
+import time
+from typing import Dict, Any, Optional, List, Tuple
 import uuid
 from datetime import datetime
 
+import orjson
+
 logger = logging.getLogger(__name__)
 
+# Whole second and its formatted ISO 8601 date/time, reused within the same second
+_timestamp_cache: Tuple[int, str] = (-1, "")
+
+# Token encoding loaded on first use, and when to retry after a failed load
+TOKEN_ENCODING_RETRY_SECONDS = 60.0
+_token_encoding: Optional[Any] = None
+_token_encoding_retry_at = 0.0
+
 def generate_id(prefix: str = "") -> str:
     """
     Generate a unique identifier.
@@ -23,7 +33,7 @@ def generate_id(prefix: str = "") -> str:
     Returns:
         A unique identifier string
     """
-    return f"{prefix}{uuid.uuid4()}"
+    return f"{prefix}{uuid.uuid4().hex}"
 
 def timestamp() -> str:
     """
@@ -32,21 +42,62 @@ def timestamp() -> str:
     Returns:
         The current timestamp as a string
     """
-    return datetime.now().isoformat()
+    global _timestamp_cache
+    
+    second, nanos = divmod(time.time_ns(), 1_000_000_000)
+    cached_second, formatted = _timestamp_cache
+    if cached_second != second:
+        formatted = datetime.fromtimestamp(second).isoformat()
+        _timestamp_cache = (second, formatted)
+    
+    return f"{formatted}.{nanos // 1000:06d}"
+
+def _get_token_encoding() -> Optional[Any]:
+    """
+    Load the shared tiktoken encoding used for token counting.
+    
+    A failed load is retried once TOKEN_ENCODING_RETRY_SECONDS have passed, so
+    a transient download error does not leave the process on approximate counts.
+    
+    Returns:
+        The cl100k_base encoding, or None if it could not be loaded
+    """
+    global _token_encoding, _token_encoding_retry_at
+    
+    if _token_encoding is not None:
+        return _token_encoding
+    
+    now = time.monotonic()
+    if now < _token_encoding_retry_at:
+        return None
+    
+    try:
+        import tiktoken
+        _token_encoding = tiktoken.get_encoding("cl100k_base")
+        return _token_encoding
+    except Exception as e:
+        _token_encoding_retry_at = now + TOKEN_ENCODING_RETRY_SECONDS
+        logger.warning(f"Token encoding unavailable, falling back to approximate counts: {str(e)}")
+        return None
 
 def count_tokens(text: str) -> int:
     """
-    Count the approximate number of tokens in a text.
+    Count the number of tokens in a text.
     
-    This is a simple approximation based on the average ratio of tokens to characters.
-    For more accurate counting, provider-specific tokenizers should be used.
+    Tokens are counted with the cl100k_base BPE encoding. If the encoding cannot
+    be loaded, this falls back to an approximation based on the average ratio
+    of tokens to characters.
     
     Args:
         text: The text to count tokens for
         
     Returns:
-        The approximate number of tokens
+        The number of tokens
     """
+    encoding = _get_token_encoding()
+    if encoding is not None:
+        return len(encoding.encode_ordinary(text))
+    
     # Simple approximation: 1 token ≈ 4 characters
     return len(text) // 4
 
@@ -65,8 +116,8 @@ def load_config(config_path: str) -> Dict[str, Any]:
         return {}
     
     try:
-        with open(config_path, 'r') as f:
-            return json.load(f)
+        with open(config_path, 'rb') as f:
+            return orjson.loads(f.read())
     except Exception as e:
         logger.error(f"Error loading configuration: {str(e)}")
         return {}
@@ -84,8 +135,8 @@ def save_config(config: Dict[str, Any], config_path: str) -> bool:
     """
     try:
         os.makedirs(os.path.dirname(config_path), exist_ok=True)
-        with open(config_path, 'w') as f:
-            json.dump(config, f, indent=2)
+        with open(config_path, 'wb') as f:
+            f.write(orjson.dumps(config, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
         return True
     except Exception as e:
         logger.error(f"Error saving configuration: {str(e)}")
@@ -120,12 +171,20 @@ def merge_dicts(dict1: Dict[str, Any], dict2: Dict[str, Any]) -> Dict[str, Any]:
         Merged dictionary
     """
     result = dict1.copy()
+    # Explicit stack of (merged dict, overriding dict) pairs instead of recursion;
+    # only subtrees present in both inputs are copied
+    stack = [(result, dict2)]
     
-    for key, value in dict2.items():
-        if key in result and isinstance(result[key], dict) and isinstance(value, dict):
-            result[key] = merge_dicts(result[key], value)
-        else:
-            result[key] = value
+    while stack:
+        target, source = stack.pop()
+        for key, value in source.items():
+            existing = target.get(key)
+            if isinstance(existing, dict) and isinstance(value, dict):
+                merged = existing.copy()
+                target[key] = merged
+                stack.append((merged, value))
+            else:
+                target[key] = value
     
     return result
 
@@ -5,13 +5,220 @@ This module implements the core orchestration service that coordinates
 between all specialized agents and manages the execution flow.
 """
 
-from typing import Dict, List, Optional, Any
-import uuid
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Any, Tuple
+import asyncio
+import re
 import logging
 from datetime import datetime
 
+import httpx
+from ulid import ULID
+
+from lumina.common import utils
+
 logger = logging.getLogger(__name__)
 
+# Connection pool settings for the HTTP client shared by all providers
+HTTP_TIMEOUT = 30.0
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+
+# Keyword patterns used by task analysis, matched case-insensitively as substrings
+_CODE_KEYWORDS_RE = re.compile(r"code|function|programming|python|javascript", re.IGNORECASE)
+_TOOL_KEYWORDS_RE = re.compile(r"search|browse|calculate|find|look up", re.IGNORECASE)
+
+# Complexity levels a task analysis can report
+COMPLEXITY_LEVELS = ("low", "medium", "high")
+
+@dataclass(frozen=True, slots=True)
+class TaskAnalysis:
+    """Complexity and requirements of a task, used for provider selection."""
+    complexity: str = "medium"
+    requires_reasoning: bool = True
+    requires_code: bool = False
+    requires_tools: bool = False
+    domain: str = "general"
+    
+    @property
+    def selection_key(self) -> Tuple[str, bool, bool]:
+        """Key into the provider selection table."""
+        return (self.complexity, self.requires_code, self.requires_tools)
+
+def _preferred_providers(complexity: str, requires_code: bool, requires_tools: bool) -> Tuple[str, ...]:
+    """
+    Apply the provider selection rules to one combination of task requirements.
+    
+    Args:
+        complexity: Task complexity level
+        requires_code: Whether the task requires code
+        requires_tools: Whether the task requires tools
+        
+    Returns:
+        IDs of the preferred providers, most preferred first
+    """
+    # Simple implementation for now - will be enhanced with sophisticated selection logic
+    preferred = []
+    
+    # For high complexity tasks requiring code, prefer OpenAI
+    if complexity == "high" and requires_code:
+        preferred.append("openai")
+    
+    # For tasks requiring tools, prefer Claude
+    if requires_tools:
+        preferred.append("claude")
+    
+    return tuple(preferred)
+
+# Preferred provider IDs for every TaskAnalysis.selection_key; keys whose preferred
+# providers are all missing fall back to the first registered provider
+_SELECTION_TABLE: Dict[Tuple[str, bool, bool], Tuple[str, ...]] = {
+    (complexity, requires_code, requires_tools): _preferred_providers(complexity, requires_code, requires_tools)
+    for complexity in COMPLEXITY_LEVELS
+    for requires_code in (False, True)
+    for requires_tools in (False, True)
+}
+
+# Asynchronous batching defaults: how long to collect requests and how many to send at once
+BATCH_WINDOW_MS = 10
+MAX_BATCH = 16
+
+class _BatchQueue:
+    """
+    Queue that groups concurrent requests for one provider into batch calls.
+    
+    A background task waits for a request, collects any further requests that
+    arrive within the batch window, and sends them to the provider in a single
+    batch call. Each caller is resolved with its own response, or with its own
+    error when only that request failed.
+    """
+    
+    def __init__(self, provider: Any, window_ms: float = BATCH_WINDOW_MS, max_batch: int = MAX_BATCH):
+        """
+        Initialize the batch queue.
+        
+        Args:
+            provider: The provider requests are batched for
+            window_ms: How long to collect requests after the first one arrives
+            max_batch: Maximum number of requests sent in one batch
+        """
+        self.provider = provider
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        # Entries taken off the queue by the worker and not yet resolved
+        self._pending: List[Tuple[str, Optional[Dict[str, Any]], asyncio.Future]] = []
+    
+    async def submit(self, message: str, context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Queue a message for the next batch and wait for its response.
+        
+        Args:
+            message: The user message to process
+            context: Optional context information
+            
+        Returns:
+            The provider response for this message
+        """
+        loop = asyncio.get_running_loop()
+        # The queue and worker belong to the event loop they were created on
+        if self._worker is None or self._worker.done() or self._worker.get_loop() is not loop:
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run(self._queue))
+        
+        future = loop.create_future()
+        self._queue.put_nowait((message, context, future))
+        return await future
+    
+    async def aclose(self) -> None:
+        """Stop the background worker and fail every request it has not answered."""
+        if self._worker is not None and not self._worker.done():
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        self._worker = None
+        
+        # Drain requests still in the queue along with the batch being collected or dispatched
+        pending = self._pending
+        self._pending = []
+        while self._queue is not None and not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        
+        error = RuntimeError("Batch queue closed before the request was processed")
+        for _, _, future in pending:
+            if not future.done():
+                future.set_exception(error)
+    
+    async def _run(self, queue: asyncio.Queue) -> None:
+        """
+        Collect queued requests into batches and dispatch them.
+        
+        Args:
+            queue: Queue of (message, context, future) entries
+        """
+        while True:
+            batch = self._pending = [await queue.get()]
+            if self.window > 0:
+                await asyncio.sleep(self.window)
+            while len(batch) < self.max_batch and not queue.empty():
+                batch.append(queue.get_nowait())
+            await self._dispatch(batch)
+            self._pending = []
+    
+    async def _dispatch(self, batch: List[Tuple[str, Optional[Dict[str, Any]], asyncio.Future]]) -> None:
+        """
+        Send a batch to the provider and resolve each caller's future.
+        
+        Args:
+            batch: Queued (message, context, future) entries
+        """
+        requests = [(message, context) for message, context, _ in batch]
+        try:
+            aprocess_batch = getattr(self.provider, "aprocess_batch", None)
+            process_batch = getattr(self.provider, "process_batch", None)
+            if aprocess_batch is not None:
+                responses = await aprocess_batch(requests)
+            elif process_batch is not None:
+                responses = await asyncio.to_thread(process_batch, requests)
+            else:
+                responses = await asyncio.gather(
+                    *(self._process_one(message, context) for message, context in requests),
+                    return_exceptions=True
+                )
+            if len(responses) != len(batch):
+                raise ValueError(f"Provider returned {len(responses)} responses for a batch of {len(batch)}")
+        except Exception as e:
+            # The whole batch failed, so every caller gets the error
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        for (_, _, future), response in zip(batch, responses):
+            if future.done():
+                continue
+            if isinstance(response, BaseException):
+                future.set_exception(response)
+            else:
+                future.set_result(response)
+    
+    async def _process_one(self, message: str, context: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Process one message of a batch for a provider without batch support.
+        
+        Args:
+            message: The user message to process
+            context: Optional context information
+            
+        Returns:
+            The provider response
+        """
+        if hasattr(self.provider, "aprocess_message"):
+            return await self.provider.aprocess_message(message, context)
+        return await asyncio.to_thread(self.provider.process_message, message, context)
+
 class OrchestrationService:
     """
     Central orchestration service for Lumina AI.
@@ -21,25 +228,79 @@ class OrchestrationService:
     selection, and task delegation.
     """
     
-    def __init__(self):
-        """Initialize the orchestration service."""
-        self.conversation_id = str(uuid.uuid4())
+    def __init__(self, batching: bool = False):
+        """
+        Initialize the orchestration service.
+        
+        Args:
+            batching: Whether aprocess_message groups concurrent requests to a
+                provider into batch calls
+        """
+        # ULIDs sort by creation time, which keeps conversation IDs ordered in logs and storage
+        self.conversation_id = str(ULID())
         self.providers = {}
         self.tools = {}
         self.memory = None
         self.security = None
         self.started_at = datetime.now()
+        self._http: Optional[httpx.AsyncClient] = None
+        self.batching = batching
+        self._batch_queues: Dict[int, _BatchQueue] = {}
         logger.info(f"Orchestration service initialized with ID: {self.conversation_id}")
     
+    @property
+    def http(self) -> httpx.AsyncClient:
+        """
+        HTTP client shared by all providers, created on first use.
+        
+        Reusing one client keeps provider connections alive across requests
+        and multiplexes them over HTTP/2. A client created after aclose() is
+        handed to every provider that accepts one.
+        """
+        if self._http is None:
+            self._open_http_client()
+        return self._http
+    
+    def _open_http_client(self) -> None:
+        """Create the shared HTTP client and hand it to every provider that accepts one."""
+        self._http = httpx.AsyncClient(http2=True, timeout=HTTP_TIMEOUT, limits=HTTP_LIMITS)
+        for provider in self.providers.values():
+            set_http_client = getattr(provider, "set_http_client", None)
+            if set_http_client is not None:
+                set_http_client(self._http)
+    
+    async def aclose(self) -> None:
+        """
+        Stop batch workers and close the shared HTTP client and its pooled connections.
+        
+        The service stays usable: a new client is created and given to the
+        providers on the next request that needs one.
+        """
+        for batch_queue in self._batch_queues.values():
+            await batch_queue.aclose()
+        self._batch_queues.clear()
+        
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+    
     def register_provider(self, provider_id: str, provider: Any) -> None:
         """
         Register an AI provider with the orchestration service.
         
+        Providers that accept an HTTP client are given the shared client.
+        
         Args:
             provider_id: Unique identifier for the provider
             provider: Provider instance implementing the BaseProvider interface
         """
         self.providers[provider_id] = provider
+        set_http_client = getattr(provider, "set_http_client", None)
+        if set_http_client is not None:
+            if self._http is None:
+                self._open_http_client()
+            else:
+                set_http_client(self._http)
         logger.info(f"Provider registered: {provider_id}")
     
     def register_tool(self, tool_id: str, tool: Any) -> None:
@@ -85,10 +346,88 @@ class OrchestrationService:
         Returns:
             A dictionary containing the response and metadata
         """
+        provider, error = self._route_message(message, user_id, context)
+        if error:
+            return error
+        
+        # Process message with selected provider
+        try:
+            response = provider.process_message(message, context)
+            return self._finalize_response(response, user_id, context)
+        except Exception as e:
+            logger.error(f"Error processing message: {str(e)}")
+            return {"error": f"Error processing message: {str(e)}"}
+    
+    async def aprocess_message(self, message: str, user_id: str, context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Process a user message asynchronously and return a response.
+        
+        Providers exposing an ``aprocess_message`` coroutine are awaited directly;
+        blocking providers are run in a worker thread so the event loop is never blocked.
+        With batching enabled, concurrent requests to the same provider are
+        combined into a single aprocess_batch or process_batch call.
+        
+        Args:
+            message: The user message to process
+            user_id: The ID of the user sending the message
+            context: Optional context information for the message
+            
+        Returns:
+            A dictionary containing the response and metadata
+        """
+        provider, error = self._route_message(message, user_id, context)
+        if error:
+            return error
+        
+        # Reopen the shared HTTP client for providers that use it after a previous aclose()
+        if self._http is None and hasattr(provider, "set_http_client"):
+            self._open_http_client()
+        
+        # Process message with selected provider
+        try:
+            if self.batching:
+                response = await self._get_batch_queue(provider).submit(message, context)
+            elif hasattr(provider, "aprocess_message"):
+                response = await provider.aprocess_message(message, context)
+            else:
+                response = await asyncio.to_thread(provider.process_message, message, context)
+            return self._finalize_response(response, user_id, context)
+        except Exception as e:
+            logger.error(f"Error processing message: {str(e)}")
+            return {"error": f"Error processing message: {str(e)}"}
+    
+    def _get_batch_queue(self, provider: Any) -> _BatchQueue:
+        """
+        Get the batch queue for a provider, creating it on first use.
+        
+        Args:
+            provider: The provider to batch requests for
+            
+        Returns:
+            The provider's batch queue
+        """
+        batch_queue = self._batch_queues.get(id(provider))
+        if batch_queue is None:
+            batch_queue = self._batch_queues[id(provider)] = _BatchQueue(provider)
+        return batch_queue
+    
+    def _route_message(self, message: str, user_id: str,
+                       context: Optional[Dict[str, Any]] = None) -> Tuple[Optional[Any], Optional[Dict[str, Any]]]:
+        """
+        Authorize and store a message, then select the provider to handle it.
+        
+        Args:
+            message: The user message to route
+            user_id: The ID of the user sending the message
+            context: Optional context information for the message
+            
+        Returns:
+            A tuple of the selected provider and an error response, one of which is None
+        """
         # Validate user permissions
         if self.security and not self.security.validate_user(user_id):
             logger.warning(f"Unauthorized access attempt by user: {user_id}")
-            return {"error": "Unauthorized"}
+            return None, {"error": "Unauthorized"}
         
         # Store message in memory
         if self.memory:
@@ -101,26 +440,34 @@ class OrchestrationService:
         provider = self._select_provider(task_analysis)
         if not provider:
             logger.error("No suitable provider available for the task")
-            return {"error": "No suitable provider available"}
+            return None, {"error": "No suitable provider available"}
         
-        # Process message with selected provider
-        try:
-            response = provider.process_message(message, context)
-            
-            # Store response in memory
-            if self.memory:
-                self.memory.store_message("assistant", response["content"], user_id, context)
-            
-            # Add metadata to response
-            response["timestamp"] = datetime.now().isoformat()
-            response["conversation_id"] = self.conversation_id
+        return provider, None
+    
+    def _finalize_response(self, response: Dict[str, Any], user_id: str,
+                           context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Store a provider response in memory and attach response metadata.
+        
+        Args:
+            response: The response returned by the provider
+            user_id: The ID of the user the response is for
+            context: Optional context information for the message
             
-            return response
-        except Exception as e:
-            logger.error(f"Error processing message: {str(e)}")
-            return {"error": f"Error processing message: {str(e)}"}
+        Returns:
+            The response with timestamp and conversation metadata added
+        """
+        # Store response in memory
+        if self.memory:
+            self.memory.store_message("assistant", response["content"], user_id, context)
+        
+        # Add metadata to response
+        response["timestamp"] = utils.timestamp()
+        response["conversation_id"] = self.conversation_id
+        
+        return response
     
-    def _analyze_task(self, message: str, context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    def _analyze_task(self, message: str, context: Optional[Dict[str, Any]] = None) -> TaskAnalysis:
         """
         Analyze the task to determine complexity and requirements.
         
@@ -129,29 +476,20 @@ class OrchestrationService:
             context: Optional context information
             
         Returns:
-            A dictionary containing task analysis results
+            The task analysis results
         """
         # Simple implementation for now - will be enhanced with NLP-based analysis
-        analysis = {
-            "complexity": "medium",
-            "requires_reasoning": True,
-            "requires_code": False,
-            "requires_tools": False,
-            "domain": "general"
-        }
-        
-        # Check for code-related keywords
-        if any(keyword in message.lower() for keyword in ["code", "function", "programming", "python", "javascript"]):
-            analysis["requires_code"] = True
-            analysis["complexity"] = "high"
+        # Check for code-related and tool-related keywords
+        requires_code = _CODE_KEYWORDS_RE.search(message) is not None
+        requires_tools = _TOOL_KEYWORDS_RE.search(message) is not None
         
-        # Check for tool-related keywords
-        if any(keyword in message.lower() for keyword in ["search", "browse", "calculate", "find", "look up"]):
-            analysis["requires_tools"] = True
-        
-        return analysis
+        return TaskAnalysis(
+            complexity="high" if requires_code else "medium",
+            requires_code=requires_code,
+            requires_tools=requires_tools
+        )
     
-    def _select_provider(self, task_analysis: Dict[str, Any]) -> Optional[Any]:
+    def _select_provider(self, task_analysis: TaskAnalysis) -> Optional[Any]:
         """
         Select the most appropriate provider for the given task.
         
@@ -165,16 +503,12 @@ class OrchestrationService:
             logger.warning("No providers registered")
             return None
         
-        # Simple implementation for now - will be enhanced with sophisticated selection logic
-        # For high complexity tasks requiring code, prefer OpenAI
-        if task_analysis["complexity"] == "high" and task_analysis["requires_code"]:
-            if "openai" in self.providers:
-                return self.providers["openai"]
-        
-        # For tasks requiring tools, prefer Claude
-        if task_analysis["requires_tools"]:
-            if "claude" in self.providers:
-                return self.providers["claude"]
+        # Take the first preferred provider that is registered, looked up on every call
+        # so changes to self.providers are always seen
+        for provider_id in _SELECTION_TABLE.get(task_analysis.selection_key, ()):
+            provider = self.providers.get(provider_id)
+            if provider is not None:
+                return provider
         
         # Default to the first available provider
-        return next(iter(self.providers.values()))
+        return next(iter(self.providers.values()), None)
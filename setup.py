@@ -8,9 +8,16 @@ setup(
         "pydantic>=2.0.0",
         "fastapi>=0.100.0",
         "uvicorn>=0.22.0",
+        "uvloop>=0.19; sys_platform != 'win32'",
+        "httptools>=0.6.0",
         "websockets>=11.0.0",
-        "httpx>=0.24.0",
+        "httpx[http2]>=0.24.0",
+        "msgspec>=0.18.0",
+        "orjson>=3.8.0",
+        "zstandard>=0.21.0",
+        "tiktoken>=0.4.0",
         "python-dotenv>=1.0.0",
+        "python-ulid>=2.0.0",
     ],
     author="Lumina AI Team",
     author_email="team@luminaai.com",
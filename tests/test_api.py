@@ -2,20 +2,54 @@
 Tests for the API gateway.
 """
 
+import asyncio
+import hashlib
+import hmac
+import httpx
+import msgspec
+import orjson
 import pytest
-from fastapi.testclient import TestClient
-from unittest.mock import MagicMock, patch
-from lumina.api.gateway import APIGateway, MessageRequest
+import zstandard
+from typing import Any, Dict, List, NamedTuple, Optional
+from lumina.api.gateway import APIGateway, build_gateway
+from lumina.common.interfaces import BaseProvider
+from lumina.orchestration.service import OrchestrationService
 
-class TestAPIGateway:
-    """Tests for the APIGateway class."""
+# Request bodies and headers shared by the HTTP tests, serialized once
+_CONTEXT = {"conversation_history": ["Previous message"]}
+_BODY_BASIC = orjson.dumps({"message": "Hello", "user_id": "test-user"})
+_BODY_CTX = orjson.dumps({"message": "Hello", "user_id": "test-user", "context": _CONTEXT})
+_HEADERS = {"Authorization": "Bearer test-token", "Content-Type": "application/json"}
+
+# Body returned by /api/messages for the stub's default response
+EXPECTED_RESPONSE = {
+    "content": "Test response",
+    "provider": "test-provider",
+    "model": "test-model",
+    "conversation_id": "test-conversation-id",
+    "timestamp": "2025-04-21T12:00:00",
+    "tokens": {"prompt": 10, "completion": 20, "total": 30},
+    "error": None
+}
+
+class ProcessMessageCall(NamedTuple):
+    """Arguments of one recorded aprocess_message call."""
+    message: str
+    user_id: str
+    context: Optional[Dict[str, Any]]
+
+class StubOrchestrationService:
+    """Stub orchestration service that records aprocess_message calls."""
     
-    @pytest.fixture
-    def orchestration_service(self):
-        """Create a mock orchestration service."""
-        service = MagicMock()
-        service.conversation_id = "test-conversation-id"
-        service.process_message.return_value = {
+    conversation_id = "test-conversation-id"
+    
+    def __init__(self):
+        self.reset()
+    
+    def reset(self):
+        """Clear recorded calls and restore the default response."""
+        self.calls: List[ProcessMessageCall] = []
+        self.response = {
             "content": "Test response",
             "provider": "test-provider",
             "model": "test-model",
@@ -23,93 +57,268 @@ class TestAPIGateway:
             "timestamp": "2025-04-21T12:00:00",
             "tokens": {"prompt": 10, "completion": 20, "total": 30}
         }
-        return service
     
-    @pytest.fixture
+    async def aprocess_message(self, message, user_id, context=None):
+        """Record the call and return the configured response."""
+        self.calls.append(ProcessMessageCall(message, user_id, context))
+        return self.response
+
+class UpstreamProvider(BaseProvider):
+    """Provider that answers through the shared HTTP client."""
+    
+    def process_message(self, message, context=None):
+        raise AssertionError("blocking path used")
+    
+    async def aprocess_message(self, message, context=None):
+        """Forward the message upstream with the shared HTTP client."""
+        response = await self.http_client.post("https://provider.test/v1/messages", content=message)
+        return {"content": response.text, "provider": "upstream"}
+    
+    def get_capabilities(self):
+        return {}
+    
+    def get_cost_estimate(self, message):
+        return 0.0
+
+class ConfiguredProvider(UpstreamProvider):
+    """Provider created from configuration."""
+    
+    def __init__(self, api_key):
+        self.api_key = api_key
+
+class TestAPIGateway:
+    """Tests for the APIGateway class."""
+    
+    @pytest.fixture(scope="module")
+    def orchestration_service(self):
+        """Create a stub orchestration service shared by the module's tests."""
+        return StubOrchestrationService()
+    
+    @pytest.fixture(autouse=True)
+    def _reset_orchestration_service(self, orchestration_service):
+        """Give each test a stub with no recorded calls and the default response."""
+        orchestration_service.reset()
+    
+    @pytest.fixture(scope="module")
     def api_gateway(self, orchestration_service):
-        """Create an API gateway with a mock orchestration service."""
+        """Create an API gateway with a stub orchestration service."""
         return APIGateway(orchestration_service)
     
-    @pytest.fixture
+    @pytest.fixture(scope="module")
     def client(self, api_gateway):
-        """Create a test client for the FastAPI app."""
+        """Create an HTTP client that calls the FastAPI app directly over ASGI, closed after the module."""
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=api_gateway.app), base_url="http://test")
+        yield client
+        # Tests run on per-test event loops, so the client is closed on a loop of its own
+        asyncio.run(client.aclose())
+    
+    @pytest.fixture(scope="module")
+    def ws_client(self, api_gateway):
+        """Create a test client for the FastAPI app's WebSocket endpoint."""
+        from fastapi.testclient import TestClient
         return TestClient(api_gateway.app)
     
-    def test_process_message_endpoint(self, client, orchestration_service):
-        """Test the process_message endpoint."""
-        # Mock token validation to always return True
-        with patch.object(APIGateway, '_validate_token', return_value=True):
-            response = client.post(
-                "/api/messages",
-                json={"message": "Hello", "user_id": "test-user"},
-                headers={"Authorization": "Bearer test-token"}
-            )
-            
-            assert response.status_code == 200
-            data = response.json()
-            assert data["content"] == "Test response"
-            assert data["provider"] == "test-provider"
-            assert data["model"] == "test-model"
-            assert data["conversation_id"] == "test-conversation-id"
-            assert data["timestamp"] == "2025-04-21T12:00:00"
-            assert data["tokens"] == {"prompt": 10, "completion": 20, "total": 30}
-            
-            orchestration_service.process_message.assert_called_once_with(
-                "Hello", "test-user", None
-            )
-    
-    def test_process_message_with_context(self, client, orchestration_service):
-        """Test the process_message endpoint with context."""
-        # Mock token validation to always return True
-        with patch.object(APIGateway, '_validate_token', return_value=True):
-            context = {"conversation_history": ["Previous message"]}
-            response = client.post(
-                "/api/messages",
-                json={"message": "Hello", "user_id": "test-user", "context": context},
-                headers={"Authorization": "Bearer test-token"}
-            )
-            
-            assert response.status_code == 200
-            orchestration_service.process_message.assert_called_once_with(
-                "Hello", "test-user", context
-            )
+    @pytest.fixture
+    def accept_all_tokens(self, monkeypatch):
+        """Make token validation accept every token."""
+        monkeypatch.setattr(APIGateway, "_validate_token", lambda self, token, user_id: True)
     
-    def test_process_message_unauthorized(self, client):
+    @pytest.mark.usefixtures("accept_all_tokens")
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("body,expected_context,error", [
+        (_BODY_BASIC, None, None),
+        (_BODY_CTX, _CONTEXT, None),
+        (_BODY_BASIC, None, "Test error")
+    ], ids=["basic", "with_context", "error"])
+    async def test_process_message_endpoint(self, client, orchestration_service, body, expected_context, error):
+        """Test the process_message endpoint, with and without context and on error."""
+        if error:
+            # Set up orchestration service to return an error
+            orchestration_service.response = {"error": error}
+        
+        response = await client.post(
+            "/api/messages",
+            content=body,
+            headers=_HEADERS
+        )
+        
+        assert response.status_code == 200
+        data = response.json()
+        if error:
+            assert (data["content"], data["error"]) == ("", error)
+        else:
+            assert data == EXPECTED_RESPONSE
+        
+        assert orchestration_service.calls == [("Hello", "test-user", expected_context)]
+    
+    @pytest.mark.asyncio
+    async def test_process_message_unauthorized(self, client):
         """Test the process_message endpoint with invalid token."""
-        response = client.post(
+        response = await client.post(
             "/api/messages",
-            json={"message": "Hello", "user_id": "test-user"}
+            content=_BODY_BASIC,
+            headers={"Content-Type": "application/json"}
         )
         
         assert response.status_code == 401
     
-    def test_process_message_error(self, client, orchestration_service):
-        """Test the process_message endpoint when an error occurs."""
-        # Mock token validation to always return True
-        with patch.object(APIGateway, '_validate_token', return_value=True):
-            # Set up orchestration service to return an error
-            orchestration_service.process_message.return_value = {
-                "error": "Test error"
-            }
+    @pytest.mark.usefixtures("accept_all_tokens")
+    @pytest.mark.asyncio
+    async def test_process_message_invalid_body(self, client, orchestration_service):
+        """Test the process_message endpoint with a malformed request body."""
+        response = await client.post(
+            "/api/messages",
+            json={"message": "Hello"},
+            headers=_HEADERS
+        )
+        
+        assert response.status_code == 422
+        assert orchestration_service.calls == []
+    
+    def test_websocket_json(self, ws_client, orchestration_service):
+        """Test exchanging JSON messages over the WebSocket endpoint."""
+        with ws_client.websocket_connect("/ws/test-client") as websocket:
+            websocket.send_json({"message": "Hello", "user_id": "test-user"})
+            data = websocket.receive_json()
+        
+        assert data["content"] == "Test response"
+        assert orchestration_service.calls == [("Hello", "test-user", None)]
+    
+    def test_websocket_msgpack(self, ws_client, orchestration_service):
+        """Test exchanging MessagePack messages over the WebSocket endpoint."""
+        with ws_client.websocket_connect("/ws/test-client", subprotocols=["msgpack"]) as websocket:
+            assert websocket.accepted_subprotocol == "msgpack"
+            websocket.send_bytes(msgspec.msgpack.encode({"message": "Hello", "user_id": "test-user"}))
+            data = msgspec.msgpack.decode(websocket.receive_bytes())
+        
+        assert data == orchestration_service.response
+    
+    def test_websocket_msgpack_zstd(self, ws_client, orchestration_service):
+        """Test that large responses are compressed on the msgpack+zstd subprotocol."""
+        orchestration_service.response = {"content": "x" * 4096}
+        
+        with ws_client.websocket_connect("/ws/test-client", subprotocols=["msgpack+zstd"]) as websocket:
+            assert websocket.accepted_subprotocol == "msgpack+zstd"
+            websocket.send_bytes(b"\x00" + msgspec.msgpack.encode({"message": "Hello", "user_id": "test-user"}))
+            data = websocket.receive_bytes()
+        
+        assert data[:1] == b"\x01"
+        assert msgspec.msgpack.decode(zstandard.ZstdDecompressor().decompress(data[1:])) == {"content": "x" * 4096}
+    
+    def test_websocket_connection_limit(self, orchestration_service):
+        """Test that WebSocket connections beyond the limit are rejected."""
+        from fastapi import WebSocketDisconnect
+        from fastapi.testclient import TestClient
+        
+        api_gateway = APIGateway(orchestration_service, max_connections=1)
+        client = TestClient(api_gateway.app)
+        
+        with client.websocket_connect("/ws/first-client"):
+            assert "first-client" in api_gateway.active_connections
+            with client.websocket_connect("/ws/second-client") as websocket:
+                with pytest.raises(WebSocketDisconnect) as exc_info:
+                    websocket.receive_json()
+                assert exc_info.value.code == 1013
+            assert "second-client" not in api_gateway.active_connections
+        
+        assert api_gateway.active_connections == {}
+    
+    def test_websocket_duplicate_client_id(self, orchestration_service):
+        """Test that a second connection with a client ID already in use is rejected."""
+        from fastapi import WebSocketDisconnect
+        from fastapi.testclient import TestClient
+        
+        api_gateway = APIGateway(orchestration_service, max_connections=2)
+        client = TestClient(api_gateway.app)
+        
+        with client.websocket_connect("/ws/same-client") as first:
+            with client.websocket_connect("/ws/same-client") as second:
+                with pytest.raises(WebSocketDisconnect) as exc_info:
+                    second.receive_json()
+                assert exc_info.value.code == 1008
             
-            response = client.post(
-                "/api/messages",
-                json={"message": "Hello", "user_id": "test-user"},
-                headers={"Authorization": "Bearer test-token"}
-            )
+            # The rejected socket does not count towards the limit or displace the first one
+            assert list(api_gateway.active_connections) == ["same-client"]
+            with client.websocket_connect("/ws/other-client"):
+                assert len(api_gateway._open_sockets) == 2
             
-            assert response.status_code == 200
-            data = response.json()
-            assert data["error"] == "Test error"
-            assert data["content"] == ""
+            first.send_json({"message": "Hello", "user_id": "test-user"})
+            assert first.receive_json()["content"] == "Test response"
+        
+        assert (api_gateway.active_connections, api_gateway._open_sockets) == ({}, set())
     
-    def test_token_validation(self, api_gateway):
+    @pytest.mark.parametrize("token,expected", [
+        ("valid-token-12345", True),  # Valid token
+        ("short", False),  # Invalid token (too short)
+        (None, False)  # None token
+    ])
+    def test_token_validation(self, api_gateway, token, expected):
         """Test token validation."""
-        # Test valid token
-        assert api_gateway._validate_token("valid-token-12345", "test-user") == True
-        
-        # Test invalid token (too short)
-        assert api_gateway._validate_token("short", "test-user") == False
+        assert api_gateway._validate_token(token, "test-user") == expected
+    
+    def test_signed_token_validation(self, orchestration_service):
+        """Test validation of HMAC-signed tokens."""
+        api_gateway = APIGateway(orchestration_service, token_secret="test-secret")
+        token = hmac.new(b"test-secret", b"test-user", hashlib.sha256).hexdigest()
         
-        # Test None token
+        assert api_gateway._validate_token(token, "test-user") == True
+        assert api_gateway._validate_token(token, "other-user") == False
+        assert api_gateway._validate_token("valid-token-12345", "test-user") == False
         assert api_gateway._validate_token(None, "test-user") == False
+    
+    def test_build_gateway_uses_jwt_secret(self, monkeypatch):
+        """Test that gateways built from configuration validate tokens with JWT_SECRET."""
+        monkeypatch.setenv("JWT_SECRET", "test-secret")
+        api_gateway = build_gateway()
+        token = hmac.new(b"test-secret", b"test-user", hashlib.sha256).hexdigest()
+        
+        assert api_gateway._validate_token(token, "test-user") == True
+        assert api_gateway._validate_token("valid-token-12345", "test-user") == False
+    
+    def test_lifespan_without_aclose(self, orchestration_service):
+        """Test that shutdown succeeds for orchestration services without aclose."""
+        from fastapi.testclient import TestClient
+        
+        with TestClient(APIGateway(orchestration_service).app):
+            pass
+    
+    @pytest.mark.usefixtures("accept_all_tokens")
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("batching", [False, True], ids=["direct", "batched"])
+    async def test_process_message_uses_shared_http_client(self, batching):
+        """Test that served requests reach providers through the shared HTTP client."""
+        service = OrchestrationService(batching=batching)
+        service._http = httpx.AsyncClient(
+            transport=httpx.MockTransport(lambda request: httpx.Response(200, text=f"echo: {request.content.decode()}"))
+        )
+        service.register_provider("upstream", UpstreamProvider())
+        api_gateway = APIGateway(service)
+        
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=api_gateway.app), base_url="http://test") as client:
+            response = await client.post("/api/messages", content=_BODY_BASIC, headers=_HEADERS)
+        await service.aclose()
+        
+        assert response.status_code == 200
+        assert (response.json()["content"], response.json()["provider"]) == ("echo: Hello", "upstream")
+    
+    def test_build_gateway_registers_configured_providers(self, tmp_path, monkeypatch):
+        """Test that gateways built from configuration register the configured providers."""
+        from lumina.common.utils import save_config
+        
+        config_path = str(tmp_path / "config.json")
+        save_config({"providers": {
+            "upstream": {"class": f"{__name__}:ConfiguredProvider", "api_key": "test-key"},
+            "unconfigured": {"api_key": "other-key"}
+        }}, config_path)
+        monkeypatch.setenv("LUMINA_CONFIG", config_path)
+        
+        service = build_gateway().orchestration_service
+        
+        assert list(service.providers) == ["upstream"]
+        assert isinstance(service.providers["upstream"], ConfiguredProvider)
+        assert service.providers["upstream"].api_key == "test-key"
+    
+    def test_run_multiple_workers_requires_factory(self, api_gateway):
+        """Test that a multi-worker run without a factory is refused."""
+        with pytest.raises(ValueError):
+            api_gateway.run(workers=2)
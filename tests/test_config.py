@@ -0,0 +1,54 @@
+"""
+Tests for the configuration manager.
+"""
+
+import pytest
+from lumina.common.config import ConfigManager
+from lumina.common.utils import save_config
+
+class TestConfigManager:
+    """Tests for the ConfigManager class."""
+    
+    @pytest.fixture
+    def config_manager(self, tmp_path):
+        """Create a configuration manager backed by a configuration file."""
+        config_path = str(tmp_path / "config.json")
+        save_config({"providers": {"openai": {"model": "gpt-4"}}}, config_path)
+        return ConfigManager(config_path)
+    
+    def test_get_nested_value(self, config_manager):
+        """Test getting leaf and intermediate values by dotted path."""
+        assert config_manager.get("providers.openai.model") == "gpt-4"
+        assert config_manager.get("providers.openai") == {"model": "gpt-4"}
+        assert config_manager.get("providers.claude.model", "default") == "default"
+    
+    def test_set_updates_lookups(self, config_manager):
+        """Test that values set after a lookup are visible to later lookups."""
+        assert config_manager.get("providers.claude.model") is None
+        
+        config_manager.set("providers.claude.model", "claude-3")
+        config_manager.set("providers.openai", {"model": "gpt-4o"})
+        
+        assert config_manager.get("providers.claude.model") == "claude-3"
+        assert config_manager.get("providers.openai.model") == "gpt-4o"
+    
+    def test_get_reads_live_configuration(self, config_manager):
+        """Test that changes made outside set() are visible to later lookups."""
+        assert config_manager.get("providers.openai.model") == "gpt-4"
+        
+        config_manager.get("providers.openai")["model"] = "gpt-4o"
+        assert config_manager.get("providers.openai.model") == "gpt-4o"
+        
+        config_manager.get_all()["providers"]["openai"]["model"] = "gpt-4-turbo"
+        assert config_manager.get("providers.openai.model") == "gpt-4-turbo"
+        
+        config_manager.config["api"] = {"port": 8000}
+        assert config_manager.get("api.port") == 8000
+    
+    def test_get_resolves_string_path_components_only(self, config_manager):
+        """Test that keys containing dots or non-string keys are not matched by a dotted path."""
+        config_manager.config["a.b"] = 1
+        config_manager.config[1] = {"c": 2}
+        
+        assert config_manager.get("a.b", "default") == "default"
+        assert config_manager.get("1.c", "default") == "default"
@@ -2,54 +2,107 @@
 Tests for the orchestration service.
 """
 
+import asyncio
+import itertools
+from datetime import datetime
 import pytest
-from unittest.mock import MagicMock
+from lumina.orchestration import service as service_module
 from lumina.orchestration.service import OrchestrationService
 
+_FIXED_DATETIME = datetime(2025, 4, 21, 12, 0, 0)
+
+class _FixedDatetime(datetime):
+    """datetime whose now() always returns the same moment."""
+    
+    @classmethod
+    def now(cls, tz=None):
+        return _FIXED_DATETIME
+
+@pytest.fixture(scope="module", autouse=True)
+def _fast_ids_and_clock():
+    """Replace conversation ID generation and the service clock with cheap deterministic stand-ins."""
+    counter = itertools.count()
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(service_module, "ULID", lambda: f"id-{next(counter)}")
+        monkeypatch.setattr(service_module, "datetime", _FixedDatetime)
+        yield
+
 class MockProvider:
     """Mock provider for testing."""
     
     def __init__(self, provider_id="mock"):
         self.provider_id = provider_id
+        self._prefix = f"Processed by {provider_id}: "
+        self._base = {"provider": provider_id, "model": "mock-model"}
+        self._capabilities = {
+            "provider": provider_id,
+            "capabilities": {
+                "text_generation": True,
+                "code_generation": provider_id == "openai",
+                "reasoning": True,
+                "tool_use": provider_id == "claude"
+            }
+        }
     
     def process_message(self, message, context=None):
         """Process a message and return a mock response."""
-        return {
-            "content": f"Processed by {self.provider_id}: {message}",
-            "provider": self.provider_id,
-            "model": "mock-model"
-        }
+        return dict(self._base, content=self._prefix + message)
     
     def get_capabilities(self):
         """Return mock capabilities."""
-        return {
-            "provider": self.provider_id,
-            "capabilities": {
-                "text_generation": True,
-                "code_generation": self.provider_id == "openai",
-                "reasoning": True,
-                "tool_use": self.provider_id == "claude"
-            }
-        }
+        return self._capabilities
+    
+    def get_cost_estimate(self, message, message_len=None):
+        """Return a mock cost estimate, using a precomputed message length if given."""
+        if message_len is None:
+            message_len = len(message)
+        return 0.001 * message_len
+
+class MockHTTPProvider(MockProvider):
+    """Mock provider that accepts a shared HTTP client."""
+    
+    http_client = None
+    
+    def set_http_client(self, client):
+        """Store the shared HTTP client."""
+        self.http_client = client
+
+class MockBatchProvider(MockProvider):
+    """Mock provider that records batch calls."""
+    
+    def __init__(self, provider_id="mock"):
+        super().__init__(provider_id)
+        self.batches = []
     
-    def get_cost_estimate(self, message):
-        """Return a mock cost estimate."""
-        return 0.001 * len(message)
+    def process_batch(self, requests):
+        """Process a batch of messages and record its size."""
+        self.batches.append(len(requests))
+        return [self.process_message(message, context) for message, context in requests]
+
+class MockFailingProvider(MockProvider):
+    """Mock provider that rejects the message "bad"."""
+    
+    def process_message(self, message, context=None):
+        """Process a message, failing for "bad"."""
+        if message == "bad":
+            raise ValueError("bad input")
+        return super().process_message(message, context)
 
 class MockMemory:
     """Mock memory system for testing."""
     
     def __init__(self):
-        self.messages = []
+        self.roles = []
+        self.contents = []
+        self.user_ids = []
+        self.contexts = []
     
     def store_message(self, role, content, user_id, context=None):
         """Store a message in memory."""
-        self.messages.append({
-            "role": role,
-            "content": content,
-            "user_id": user_id,
-            "context": context
-        })
+        self.roles.append(role)
+        self.contents.append(content)
+        self.user_ids.append(user_id)
+        self.contexts.append(context)
 
 class MockSecurity:
     """Mock security system for testing."""
@@ -61,6 +114,31 @@ class MockSecurity:
 class TestOrchestrationService:
     """Tests for the OrchestrationService class."""
     
+    @pytest.fixture
+    def configured_service(self):
+        """Create a service with a mock provider, memory, and security system."""
+        service = OrchestrationService()
+        service.register_provider("mock", MockProvider())
+        service.set_memory(MockMemory())
+        service.set_security(MockSecurity())
+        return service
+    
+    @pytest.fixture
+    def dual_provider_service(self):
+        """Create a service with mock OpenAI and Claude providers."""
+        service = OrchestrationService()
+        service.register_provider("openai", MockProvider("openai"))
+        service.register_provider("claude", MockProvider("claude"))
+        return service
+    
+    @pytest.fixture
+    def three_provider_service(self):
+        """Create a service with mock Gemini, OpenAI and Claude providers, Gemini first."""
+        service = OrchestrationService()
+        for provider_id in ("gemini", "openai", "claude"):
+            service.register_provider(provider_id, MockProvider(provider_id))
+        return service
+    
     def test_initialization(self):
         """Test that the service initializes correctly."""
         service = OrchestrationService()
@@ -82,10 +160,10 @@ class TestOrchestrationService:
     def test_register_tool(self):
         """Test registering a tool."""
         service = OrchestrationService()
-        tool = MagicMock()
+        tool = object()
         service.register_tool("mock_tool", tool)
         assert "mock_tool" in service.tools
-        assert service.tools["mock_tool"] == tool
+        assert service.tools["mock_tool"] is tool
     
     def test_set_memory(self):
         """Test setting the memory system."""
@@ -101,17 +179,10 @@ class TestOrchestrationService:
         service.set_security(security)
         assert service.security == security
     
-    def test_process_message_with_valid_user(self):
+    def test_process_message_with_valid_user(self, configured_service):
         """Test processing a message with a valid user."""
-        service = OrchestrationService()
-        provider = MockProvider()
-        service.register_provider("mock", provider)
-        
-        memory = MockMemory()
-        service.set_memory(memory)
-        
-        security = MockSecurity()
-        service.set_security(security)
+        service = configured_service
+        memory = service.memory
         
         response = service.process_message("Hello", "valid_user")
         
@@ -120,29 +191,22 @@ class TestOrchestrationService:
         assert response["provider"] == "mock"
         assert "timestamp" in response
         assert "conversation_id" in response
-        assert len(memory.messages) == 2
-        assert memory.messages[0]["role"] == "user"
-        assert memory.messages[0]["content"] == "Hello"
-        assert memory.messages[1]["role"] == "assistant"
-        assert memory.messages[1]["content"] == "Processed by mock: Hello"
+        assert memory.roles == ["user", "assistant"]
+        assert memory.contents == ["Hello", "Processed by mock: Hello"]
     
     def test_process_message_with_invalid_user(self):
         """Test processing a message with an invalid user."""
+        # No provider is needed: the request is rejected before provider selection
         service = OrchestrationService()
-        provider = MockProvider()
-        service.register_provider("mock", provider)
-        
         memory = MockMemory()
         service.set_memory(memory)
-        
-        security = MockSecurity()
-        service.set_security(security)
+        service.set_security(MockSecurity())
         
         response = service.process_message("Hello", "invalid_user")
         
         assert "error" in response
         assert response["error"] == "Unauthorized"
-        assert len(memory.messages) == 0
+        assert memory.roles == []
     
     def test_process_message_with_no_providers(self):
         """Test processing a message with no providers registered."""
@@ -151,30 +215,132 @@ class TestOrchestrationService:
         assert "error" in response
         assert response["error"] == "No suitable provider available"
     
-    def test_provider_selection_for_code_task(self):
+    def test_provider_selection_for_code_task(self, dual_provider_service):
         """Test provider selection for a code-related task."""
-        service = OrchestrationService()
-        openai_provider = MockProvider("openai")
-        claude_provider = MockProvider("claude")
-        
-        service.register_provider("openai", openai_provider)
-        service.register_provider("claude", claude_provider)
+        service = dual_provider_service
         
         response = service.process_message("Write a Python function to calculate Fibonacci numbers", "valid_user")
         
         assert "content" in response
         assert "openai" in response["content"]
     
-    def test_provider_selection_for_tool_task(self):
+    def test_provider_selection_for_tool_task(self, dual_provider_service):
         """Test provider selection for a tool-related task."""
-        service = OrchestrationService()
-        openai_provider = MockProvider("openai")
-        claude_provider = MockProvider("claude")
-        
-        service.register_provider("openai", openai_provider)
-        service.register_provider("claude", claude_provider)
+        service = dual_provider_service
         
         response = service.process_message("Search for the latest news about AI", "valid_user")
         
         assert "content" in response
         assert "claude" in response["content"]
+    
+    def test_provider_selection_after_removing_preferred_provider(self, three_provider_service):
+        """Test that the next preferred provider is chosen when the first is removed directly."""
+        service = three_provider_service
+        del service.providers["openai"]
+        
+        response = service.process_message("Write a Python function to search the docs", "valid_user")
+        
+        assert response["provider"] == "claude"
+    
+    def test_provider_selection_after_adding_preferred_provider(self):
+        """Test that a preferred provider added directly to providers is chosen."""
+        service = OrchestrationService()
+        service.register_provider("gemini", MockProvider("gemini"))
+        service.providers["claude"] = MockProvider("claude")
+        
+        response = service.process_message("Search for the latest news about AI", "valid_user")
+        
+        assert response["provider"] == "claude"
+    
+    @pytest.mark.asyncio
+    async def test_aprocess_message_with_blocking_provider(self):
+        """Test processing a message asynchronously with a blocking provider."""
+        service = OrchestrationService()
+        provider = MockProvider()
+        service.register_provider("mock", provider)
+        
+        memory = MockMemory()
+        service.set_memory(memory)
+        
+        response = await service.aprocess_message("Hello", "valid_user")
+        
+        assert response["content"] == "Processed by mock: Hello"
+        assert response["conversation_id"] == service.conversation_id
+        assert memory.roles == ["user", "assistant"]
+    
+    @pytest.mark.asyncio
+    async def test_shared_http_client(self):
+        """Test that providers receive the shared HTTP client, and a new one after it is closed."""
+        service = OrchestrationService()
+        first_provider = MockHTTPProvider("first")
+        second_provider = MockHTTPProvider("second")
+        service.register_provider("first", first_provider)
+        service.register_provider("second", second_provider)
+        
+        assert first_provider.http_client is service.http
+        assert second_provider.http_client is service.http
+        
+        client = service.http
+        await service.aclose()
+        assert client.is_closed
+        
+        # The next request reopens the client and hands it to every provider again
+        await service.aprocess_message("Hello", "valid_user")
+        assert not service.http.is_closed
+        assert first_provider.http_client is service.http
+        assert second_provider.http_client is service.http
+        await service.aclose()
+    
+    @pytest.mark.asyncio
+    async def test_aprocess_message_batches_concurrent_requests(self):
+        """Test that concurrent requests are combined into one batch call."""
+        service = OrchestrationService(batching=True)
+        provider = MockBatchProvider()
+        service.register_provider("mock", provider)
+        
+        responses = await asyncio.gather(
+            *(service.aprocess_message(f"Hello {i}", "valid_user") for i in range(3))
+        )
+        await service.aclose()
+        
+        assert provider.batches == [3]
+        assert [response["content"] for response in responses] == [
+            f"Processed by mock: Hello {i}" for i in range(3)
+        ]
+    
+    @pytest.mark.asyncio
+    async def test_aclose_fails_pending_batched_requests(self):
+        """Test that requests waiting for a batch are answered with an error on shutdown."""
+        service = OrchestrationService(batching=True)
+        provider = MockBatchProvider()
+        service.register_provider("mock", provider)
+        service._get_batch_queue(provider).window = 60
+        
+        # The first request is held in the batch window, the second still queued behind it
+        tasks = [asyncio.create_task(service.aprocess_message(f"Hello {i}", "valid_user")) for i in range(2)]
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        batch_queue = service._get_batch_queue(provider)
+        assert (len(batch_queue._pending), batch_queue._queue.qsize()) == (1, 1)
+        await service.aclose()
+        
+        responses = await asyncio.wait_for(asyncio.gather(*tasks), timeout=1)
+        
+        assert provider.batches == []
+        assert all(response["error"].startswith("Error processing message: Batch queue closed") for response in responses)
+    
+    @pytest.mark.asyncio
+    async def test_batch_with_one_failing_request(self):
+        """Test that a failing request in a batch does not fail the others."""
+        service = OrchestrationService(batching=True)
+        service.register_provider("mock", MockFailingProvider())
+        
+        responses = await asyncio.gather(
+            *(service.aprocess_message(message, "valid_user") for message in ("a", "bad", "c"))
+        )
+        await service.aclose()
+        
+        assert [response.get("content") for response in responses] == [
+            "Processed by mock: a", None, "Processed by mock: c"
+        ]
+        assert responses[1]["error"] == "Error processing message: bad input"
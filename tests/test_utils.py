@@ -0,0 +1,45 @@
+"""
+Tests for the common utility functions.
+"""
+
+import pytest
+import tiktoken
+from lumina.common import utils
+
+class FakeEncoding:
+    """Encoding that produces one token per word."""
+
+    def encode_ordinary(self, text):
+        return text.split()
+
+@pytest.fixture
+def fresh_token_encoding(monkeypatch):
+    """Reset the cached token encoding so each test loads it again."""
+    monkeypatch.setattr(utils, "_token_encoding", None)
+    monkeypatch.setattr(utils, "_token_encoding_retry_at", 0.0)
+
+def test_count_tokens_with_encoding(monkeypatch, fresh_token_encoding):
+    """Test that tokens are counted with the loaded encoding."""
+    monkeypatch.setattr(tiktoken, "get_encoding", lambda name: FakeEncoding())
+
+    assert utils.count_tokens("one two three") == 3
+
+def test_count_tokens_fallback_retries_encoding(monkeypatch, fresh_token_encoding):
+    """Test the approximate count when loading fails, and that the load is retried later."""
+    attempts = []
+
+    def failing_get_encoding(name):
+        attempts.append(name)
+        raise OSError("network unreachable")
+
+    monkeypatch.setattr(tiktoken, "get_encoding", failing_get_encoding)
+
+    assert utils.count_tokens("a" * 40) == 10
+    assert utils.count_tokens("a" * 40) == 10
+    assert len(attempts) == 1
+
+    # Once the retry interval has passed, the encoding is loaded again
+    monkeypatch.setattr(tiktoken, "get_encoding", lambda name: FakeEncoding())
+    monkeypatch.setattr(utils, "_token_encoding_retry_at", 0.0)
+
+    assert utils.count_tokens("one two three") == 3